@@ -14,82 +14,161 @@ Output:
     - Pixel grid GeoJSON file clipped to areas near utility infrastructure
 """
 
+import os
+import sys
 import argparse
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from itertools import product
+import pyogrio
+import pyproj
+import shapely
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 warnings.filterwarnings('ignore')
 
 
-def create_california_grid():
+# Grid parameters (100m spacing in California Albers projection)
+# These coordinates cover all of California
+GRID_CRS = 'EPSG:3310'
+GRID_SPACING = 100
+XCOORDS = np.arange(-381105 + 50, -381105 + (100 * 9220), 100)
+YCOORDS = np.arange(456105 - (100 * 10630) - 50, 456105, 100)
+
+# Grid cells as integer (column, row) indices into XCOORDS/YCOORDS
+GRID_CELL_DTYPE = np.dtype([('ix', np.int32), ('iy', np.int32)])
+
+# Closed square ring offsets, in cap_style=3 buffer vertex order
+SQUARE_RING = np.array([[1, 1], [1, -1], [-1, -1], [-1, 1], [1, 1]], dtype=np.float64)
+
+# Number of grid cells turned into points and queried at a time
+BATCH_SIZE = 1_000_000
+
+# Number of squares reprojected and written to the output at a time
+WRITE_BATCH_SIZE = 250_000
+
+# Output drivers by file extension (anything else is written as GeoJSON)
+OUTPUT_DRIVERS = {
+    '.json': 'GeoJSON',
+    '.geojson': 'GeoJSON',
+    '.gpkg': 'GPKG',
+    '.fgb': 'FlatGeobuf',
+}
+
+
+def grid_points(cells):
     """
-    Create a 100m x 100m grid covering California.
-    Uses NAD83 / California Albers projection (EPSG:3310).
+    Build centroid points for grid cells.
+
+    Args:
+        cells: Structured array of GRID_CELL_DTYPE grid cells
 
     Returns:
-        GeoDataFrame: Grid centroids in EPSG:3310
+        ndarray: Shapely Point geometries in EPSG:3310
     """
-    print("Creating California grid...")
-
-    # Grid parameters (100m spacing in California Albers projection)
-    # These coordinates cover all of California
-    xcoords = np.arange(-381105 + 50, -381105 + (100 * 9220), 100)
-    ycoords = np.arange(456105 - (100 * 10630) - 50, 456105, 100)
+    return shapely.points(XCOORDS[cells['ix']], YCOORDS[cells['iy']])
 
-    print(f"  Grid dimensions: {len(xcoords)} x {len(ycoords)} = {len(xcoords) * len(ycoords):,} points")
 
-    # Create all combinations of x,y coordinates
-    combinations = np.array(list(product(xcoords, ycoords)))
+def create_california_grid(bounds=None):
+    """
+    Create a 100m x 100m grid covering California.
+    Uses NAD83 / California Albers projection (EPSG:3310).
 
-    # Create GeoDataFrame with point centroids
-    centroids = gpd.GeoDataFrame(
-        geometry=gpd.points_from_xy(combinations[:, 0], combinations[:, 1])
-    )
-    centroids.set_crs('EPSG:3310', inplace=True)
+    Args:
+        bounds: Optional (N, 4) array of (minx, miny, maxx, maxy) boxes in
+            EPSG:3310. When given, only grid points falling inside at least
+            one box are created instead of the full California grid.
 
-    print(f"  Created {len(centroids):,} grid points")
-    return centroids
+    Returns:
+        ndarray: Structured array of GRID_CELL_DTYPE grid cells
+    """
+    print("Creating California grid...")
 
+    nx, ny = len(XCOORDS), len(YCOORDS)
+    print(f"  Grid dimensions: {nx} x {ny} = {nx * ny:,} points")
 
-def clip_to_utility_lines(centroids, utility_lines, buffer_meters=75):
+    if bounds is None:
+        # All combinations of column/row indices (x-major, same ordering as
+        # itertools.product)
+        cells = np.empty(nx * ny, dtype=GRID_CELL_DTYPE)
+        cells['ix'] = np.repeat(np.arange(nx, dtype=np.int32), ny)
+        cells['iy'] = np.tile(np.arange(ny, dtype=np.int32), nx)
+    else:
+        # Snap each box to the grid and mark the covered cells
+        bounds = np.asarray(bounds, dtype=np.float64)
+        bounds = bounds[~np.isnan(bounds).any(axis=1)]
+        print(f"  Restricting grid to {len(bounds):,} bounding boxes...")
+
+        ix0 = np.ceil((bounds[:, 0] - XCOORDS[0]) / GRID_SPACING).astype(np.int64)
+        iy0 = np.ceil((bounds[:, 1] - YCOORDS[0]) / GRID_SPACING).astype(np.int64)
+        ix1 = np.floor((bounds[:, 2] - XCOORDS[0]) / GRID_SPACING).astype(np.int64) + 1
+        iy1 = np.floor((bounds[:, 3] - YCOORDS[0]) / GRID_SPACING).astype(np.int64) + 1
+        np.clip(ix0, 0, nx, out=ix0)
+        np.clip(ix1, 0, nx, out=ix1)
+        np.clip(iy0, 0, ny, out=iy0)
+        np.clip(iy1, 0, ny, out=iy1)
+
+        mask = np.zeros((nx, ny), dtype=bool)
+        for x0, x1, y0, y1 in zip(ix0, ix1, iy0, iy1):
+            mask[x0:x1, y0:y1] = True
+
+        ix, iy = np.nonzero(mask)
+        cells = np.empty(len(ix), dtype=GRID_CELL_DTYPE)
+        cells['ix'] = ix
+        cells['iy'] = iy
+
+    print(f"  Created {len(cells):,} grid points")
+    return cells
+
+
+def clip_to_utility_lines(cells, utility_lines, buffer_meters=75):
     """
     Clip grid to areas within buffer_meters of utility lines.
 
+    Uses an STRtree "dwithin" query against the utility lines rather than
+    buffering them and clipping the grid to the buffer polygons. The grid is
+    queried in batches of BATCH_SIZE cells spread over all CPU cores.
+
     Args:
-        centroids: GeoDataFrame of grid centroids
+        cells: Structured array of GRID_CELL_DTYPE grid cells
         utility_lines: GeoDataFrame of utility line geometries
         buffer_meters: Distance in meters to buffer utility lines (default: 75)
 
     Returns:
-        GeoDataFrame: Clipped centroids near utility infrastructure
+        ndarray: Grid cells near utility infrastructure
     """
     print(f"\nClipping grid to areas within {buffer_meters}m of utility lines...")
 
-    # Reproject utility lines to match centroids CRS
-    utility_lines_reproj = utility_lines.to_crs(centroids.crs)
+    # Reproject utility lines to match the grid CRS
+    utility_lines_reproj = utility_lines.to_crs(GRID_CRS)
     print(f"  Utility lines: {len(utility_lines_reproj):,} features")
 
-    # Buffer utility lines
-    print(f"  Buffering utility lines by {buffer_meters}m...")
-    utility_buffer = utility_lines_reproj.buffer(buffer_meters)
+    # Index the unbuffered lines; dwithin stands in for the buffer
+    print("  Building spatial index over utility lines...")
+    tree = shapely.STRtree(utility_lines_reproj.geometry.values)
 
-    # Clip centroids to buffered utility lines
-    print("  Clipping grid to utility buffer...")
-    centroids_clipped = centroids.clip(utility_buffer)
+    # Keep cells whose centroid is within buffer_meters of any utility line
+    def near_lines(batch):
+        point_idx, _ = tree.query(grid_points(batch), predicate='dwithin', distance=buffer_meters)
+        return batch[np.unique(point_idx)]
 
-    print(f"  Clipped to {len(centroids_clipped):,} points ({len(centroids_clipped)/len(centroids)*100:.1f}% of original)")
+    print(f"  Selecting grid points within {buffer_meters}m of utility lines...")
+    batches = [cells[i:i + BATCH_SIZE] for i in range(0, len(cells), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        cells_clipped = np.concatenate([cells[:0]] + list(executor.map(near_lines, batches)))
 
-    return centroids_clipped
+    pct = len(cells_clipped)/len(cells)*100 if len(cells) else 0.0
+    print(f"  Clipped to {len(cells_clipped):,} points ({pct:.1f}% of candidate cells)")
 
+    return cells_clipped
 
-def centroids_to_squares(centroids, square_size=50):
+
+def centroids_to_squares(cells, square_size=50):
     """
-    Convert point centroids to square polygons.
+    Convert grid cells to square polygons around their centroids.
 
     Args:
-        centroids: GeoDataFrame of point geometries
+        cells: Structured array of GRID_CELL_DTYPE grid cells
         square_size: Half-width of square in meters (default: 50 for 100m squares)
 
     Returns:
@@ -97,12 +176,16 @@ def centroids_to_squares(centroids, square_size=50):
     """
     print("\nConverting centroids to 100m x 100m squares...")
 
-    # Buffer points with square cap style (cap_style=3)
-    # This creates 100m x 100m squares from point centroids
-    squares = centroids.buffer(square_size, cap_style=3)
+    # Build the square rings directly from the centroid coordinates
+    centers = np.empty((len(cells), 1, 2), dtype=np.float64)
+    centers[:, 0, 0] = XCOORDS[cells['ix']]
+    centers[:, 0, 1] = YCOORDS[cells['iy']]
+    corners = np.empty((len(cells), len(SQUARE_RING), 2), dtype=np.float64)
+    np.add(centers, SQUARE_RING * square_size, out=corners)
+    squares = shapely.polygons(corners)
 
     # Create GeoDataFrame with empty properties (attributes will be added by jscript.py)
-    squares_gdf = gpd.GeoDataFrame(geometry=squares, crs=centroids.crs)
+    squares_gdf = gpd.GeoDataFrame(geometry=squares, crs=GRID_CRS)
 
     print(f"  Created {len(squares_gdf):,} square polygons")
 
@@ -112,6 +195,8 @@ def centroids_to_squares(centroids, square_size=50):
 def save_output(gdf, output_path, output_crs="EPSG:4326"):
     """
     Save GeoDataFrame to file in specified CRS.
+    The output format is picked from the file extension (see OUTPUT_DRIVERS),
+    and features are reprojected and appended WRITE_BATCH_SIZE at a time.
 
     Args:
         gdf: GeoDataFrame to save
@@ -119,19 +204,33 @@ def save_output(gdf, output_path, output_crs="EPSG:4326"):
         output_crs: Target CRS (default: EPSG:4326 / WGS84)
     """
     print(f"\nSaving output to {output_path}...")
+    driver = OUTPUT_DRIVERS.get(os.path.splitext(output_path)[1].lower(), 'GeoJSON')
 
     # Convert to output CRS
     if output_crs == "EPSG:4326":
         # Use OGC CRS84 for better GeoJSON compatibility
-        gdf_out = gdf.to_crs("urn:ogc:def:crs:OGC:1.3:CRS84")
+        output_crs = pyproj.CRS("urn:ogc:def:crs:OGC:1.3:CRS84")
     else:
-        gdf_out = gdf.to_crs(output_crs)
+        output_crs = pyproj.CRS(output_crs)
+
+    # Reproject every vertex of an array of geometries in a single pyproj call
+    transformer = pyproj.Transformer.from_crs(gdf.crs, output_crs, always_xy=True)
+
+    def transform(geoms):
+        return shapely.transform(
+            geoms,
+            lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+        )
 
     # Save to file
-    gdf_out.to_file(output_path, driver='GeoJSON')
+    for i in range(0, max(len(gdf), 1), WRITE_BATCH_SIZE):
+        batch = gdf.iloc[i:i + WRITE_BATCH_SIZE]
+        batch = batch.set_geometry(gpd.GeoSeries(transform(batch.geometry.values), index=batch.index, crs=output_crs))
+        pyogrio.write_dataframe(batch, output_path, driver=driver, append=bool(i))
 
-    print(f"  Saved {len(gdf_out):,} features")
-    print(f"  CRS: {gdf_out.crs}")
+    print(f"  Saved {len(gdf):,} features")
+    print(f"  CRS: {output_crs}")
+    print(f"  Format: {driver}")
 
 
 def run(input_file, output_file, buffer_meters=75):
@@ -147,20 +246,27 @@ def run(input_file, output_file, buffer_meters=75):
     print("UTILITY LINE PIXELATION")
     print("=" * 70)
 
-    # Step 1: Create California grid
-    centroids = create_california_grid()
-
-    # Step 2: Read utility lines
-    print(f"\nReading utility lines from {input_file}...")
-    utility_lines = gpd.read_file(input_file)
+    # Step 1: Read utility lines
+    print(f"Reading utility lines from {input_file}...")
+    utility_lines = pyogrio.read_dataframe(input_file)
     print(f"  Loaded {len(utility_lines):,} utility line features")
     print(f"  CRS: {utility_lines.crs}")
+    utility_lines = utility_lines.to_crs(GRID_CRS)
+
+    # Step 2: Create California grid within the buffered line bounding boxes
+    print()
+    bounds = shapely.bounds(utility_lines.geometry.values)
+    bounds[:, :2] -= buffer_meters
+    bounds[:, 2:] += buffer_meters
+    cells = create_california_grid(bounds)
+    if len(cells) == 0:
+        sys.exit("No grid cells near the utility lines; check that the input has features inside California and a correct CRS")
 
     # Step 3: Clip grid to utility buffer
-    centroids_clipped = clip_to_utility_lines(centroids, utility_lines, buffer_meters)
+    cells_clipped = clip_to_utility_lines(cells, utility_lines, buffer_meters)
 
     # Step 4: Convert centroids to squares
-    squares = centroids_to_squares(centroids_clipped)
+    squares = centroids_to_squares(cells_clipped)
 
     # Step 5: Save output
     save_output(squares, output_file)
@@ -185,7 +291,7 @@ if __name__ == "__main__":
     parser.add_argument(
         '-o', '--output',
         required=True,
-        help='Output pixel grid GeoJSON file'
+        help='Output pixel grid file (.json/.geojson, .gpkg or .fgb)'
     )
 
     parser.add_argument(
@@ -1,18 +1,15 @@
 import warnings
 warnings.filterwarnings('ignore')
 
-import glob
-import tqdm
 import yaml
-import fiona
-import pickle
 import shapely
 import argparse
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from scipy import signal
-import matplotlib.pyplot as plt
+import pyogrio
+import pyproj
+from joblib import Parallel, delayed
 
 
 def run(config):
@@ -24,137 +21,141 @@ def run(config):
     for j in config['jurisdictions']:
         jname = j['name']
         jbfile = j['boundary']
-        jbounds[jname] = gpd.read_file('{}\\{}'.format(DATA_PATH, jbfile))
+        jbounds[jname] = pyogrio.read_dataframe('{}\\{}'.format(DATA_PATH, jbfile))
     
     for pixel_type in ['priority', 'feasibility']:
         assert pixel_type in config, f'{pixel_type} not found in config file, exiting'
 
         pixels_fname = config[pixel_type]['pixels']
         print('Reading in {} pixels...'.format(pixel_type), end=' ', flush=True)
-        pixels = gpd.read_file('{}\\{}'.format(DATA_PATH, pixels_fname))
+        pixels = pyogrio.read_dataframe('{}\\{}'.format(DATA_PATH, pixels_fname))
         print('done')
 
-        pixels['centroid'] = pixels.geometry.centroid
-        pixels.set_geometry('centroid', inplace=True)
+        polys = pixels.geometry.values
+        pixels['geometry'] = pixels.geometry.centroid
+
+        # Tree positions are pixel labels (pixels are read with a default RangeIndex)
+        pixel_tree = shapely.STRtree(pixels.geometry.values)
+
+        pixel_x, pixel_y = shapely.get_coordinates(pixels.geometry.values).T
+        pixel_idx = {}
         for k, v in jbounds.items():
-            pixels_clipped = gpd.clip(pixels, v.to_crs(pixels.crs))
-            pixel_dfs[pixel_type][k] = pixels_clipped
+            jgeom = shapely.union_all(v.to_crs(pixels.crs).geometry.values)
+            shapely.prepare(jgeom)
+            idx = np.sort(pixel_tree.query(jgeom))
+            pixel_idx[k] = idx[shapely.intersects_xy(jgeom, pixel_x[idx], pixel_y[idx])]
+
+        in_jbounds = np.unique(np.concatenate([np.empty(0, dtype=np.intp), *pixel_idx.values()]))
+        pixel_bounds = shapely.total_bounds(polys[in_jbounds]) if len(in_jbounds) else None
 
         attributes = config[pixel_type]['attributes']
-        print('Joining in attributes:')
+        att_datas = []
         if attributes:
             for att_file in attributes:
-                print('\tFrom file {}...'.format(att_file['file']))
-                att_data = gpd.read_file('{}\\{}'.format(DATA_PATH, att_file['file']))
-
                 for column in att_file['columns']:
-                    col = column['column']
-                    name = column['name']
-                    join = column['join']
-                    assert join in ['binary', 'binary_full', 'numeric', 'nearest', 'popmul', 'max'], "Inappropriate join type specified"
-                    
-                    print('\t\t{}...'.format(name), end=' ', flush=True)
-                    for k in pixel_dfs[pixel_type].keys():
-                        if join=='binary':
-                            pixel_dfs[pixel_type][k] = join_binary(pixel_dfs[pixel_type][k], att_data, name)
-                        elif join=='binary_full':
-                            pixel_dfs[pixel_type][k] = join_binary_full(pixel_dfs[pixel_type][k], att_data, name)
-                        elif join=='numeric':
-                            pixel_dfs[pixel_type][k] = join_numeric(pixel_dfs[pixel_type][k], att_data, col, name)
-                        elif join=='nearest':
-                            pixel_dfs[pixel_type][k] = join_nearest(pixel_dfs[pixel_type][k], att_data, col, name)
-                        elif join=='popmul':
-                            pixel_dfs[pixel_type][k] = join_popmul(pixel_dfs[pixel_type][k], att_data, col, 'pop', name)
-                        elif join=='max':
-                            pixel_dfs[pixel_type][k] = join_max(pixel_dfs[pixel_type][k], att_data, col, name)
-                    print('done')
-
-        for k in pixel_dfs[pixel_type].keys():
-            pixel_dfs[pixel_type][k].set_geometry('geometry', inplace=True)
-            to_drop = ['centroid']
-            pixel_dfs[pixel_type][k].drop(columns=to_drop, inplace=True, errors='ignore')
+                    assert column['join'] in ['binary', 'binary_full', 'numeric', 'nearest', 'popmul', 'max'], "Inappropriate join type specified"
+                print('Reading in attributes from {}...'.format(att_file['file']), end=' ', flush=True)
+                # Nearest joins can match features outside the pixel bounds
+                att_path = '{}\\{}'.format(DATA_PATH, att_file['file'])
+                bbox = None
+                if all(column['join'] not in ['nearest', 'popmul'] for column in att_file['columns']):
+                    bbox = read_bbox(att_path, pixels.crs, pixel_bounds)
+                att_data = pyogrio.read_dataframe(att_path, bbox=bbox).to_crs(pixels.crs)
+
+                hits = None
+                if any(column['join'] in ['binary', 'numeric'] for column in att_file['columns']):
+                    hits = pixel_tree.query(att_data.geometry.values, predicate='intersects')
+                att_datas.append((att_file, att_data, hits))
+                print('done')
+
+        print('Joining in attributes:')
+        joined = pixels.iloc[in_jbounds]
+        columns = []
+        for att_file, att_data, hits in att_datas:
+            for column in att_file['columns']:
+                right = att_data
+                if column['join'] in ['nearest', 'popmul', 'max']:
+                    right = att_data[[column['column'], att_data.geometry.name]]
+                columns.append((column, right, hits))
+        results = Parallel(n_jobs=-1, prefer='threads')(
+            delayed(join_column)(joined, right, hits, polys, column) for column, right, hits in columns)
+        joined = joined.assign(**{column['name']: values for (column, _, _), values in zip(columns, results)})
+
+        for k, idx in pixel_idx.items():
+            pixel_dfs[pixel_type][k] = joined.loc[idx]
+            pixel_dfs[pixel_type][k]['geometry'] = polys[idx]
 
             outfile = "{}\\{}_{}.json".format(OUTPUT_PATH, k, pixel_type)
             print('Saving to {}...'.format(outfile), end=' ', flush=True)
-            pixel_dfs[pixel_type][k].to_file(outfile, driver='GeoJSON')
+            pyogrio.write_dataframe(pixel_dfs[pixel_type][k], outfile, driver='GeoJSON')
             print('done')
 
     return
 
 
-def join_binary_full(left, right, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left.set_geometry('geometry', inplace=True)
-    left = gpd.sjoin(left, right2.to_crs(left.crs), how="left")
-    left.set_geometry('centroid', inplace=True)
-    left.loc[~left.index_right.isnull(), 'index_right'] = 1
-    left = left.sort_values('index_right', ascending=False).drop_duplicates('geometry').sort_index()
-    left['index_right'].fillna(0, inplace=True)
-    left.rename(columns={"index_right": name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_binary(left, right, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin(left, right2.to_crs(left.crs), how="left")
-    left.loc[~left.index_right.isnull(), 'index_right'] = 1
-    left['index_right'].fillna(0, inplace=True)
-    left.rename(columns={"index_right": name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_numeric(left, right, column, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin(left, right2.to_crs(left.crs), how="left")
-    left = left.sort_values(column, ascending=False).drop_duplicates('geometry').sort_index()
-    left.loc[left['index_right'].isna(), column] = 0
-    left.rename(columns={column: name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_nearest(left, right, column, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin_nearest(left, right2.to_crs(left.crs), how="left")
-    left = left.sort_values(column, ascending=False).drop_duplicates('geometry').sort_index()
-    left.rename(columns={column: name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_popmul(left, right, column, pop_col, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin_nearest(left, right2.to_crs(left.crs), how="left")
-    left = left.sort_values(column, ascending=False).drop_duplicates('geometry').sort_index()
-    left[name] = left[pop_col]*left[column]
-    left.drop(columns=['index_left', 'index_right', column], inplace=True, errors='ignore')
-    return left
-
-
-def join_max(left, right, column, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left.set_geometry('geometry', inplace=True)
-    left = left.sjoin(right2.to_crs(left.crs), how='left')
-    left.set_geometry('centroid', inplace=True)
-    left = left.sort_values(column, ascending=False).drop_duplicates('geometry').sort_index()
-    left[column].fillna(0, inplace=True)
-    left.rename(columns={column: name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
+def read_bbox(path, crs, bounds):
+    file_crs = pyogrio.read_info(path)['crs']
+    if file_crs is None or bounds is None:
+        return None
+    transformer = pyproj.Transformer.from_crs(crs, file_crs, always_xy=True)
+    return transformer.transform_bounds(*bounds, densify_pts=21)
+
+
+def join_column(left, right, hits, polys, column):
+    col = column['column']
+    join = column['join']
+
+    if join=='binary':
+        values = join_binary(left, hits)
+    elif join=='binary_full':
+        values = join_binary_full(left, right, polys)
+    elif join=='numeric':
+        values = join_numeric(left, right, hits, col)
+    elif join=='nearest':
+        values = join_nearest(left, right, col)
+    elif join=='popmul':
+        values = join_popmul(left, right, col, 'pop')
+    elif join=='max':
+        values = join_max(left, right, polys, col)
+
+    print('\t{}... done'.format(column['name']), flush=True)
+    return values
+
+
+def join_binary_full(left, right, polys):
+    tree = shapely.STRtree(right.geometry.values)
+    left_idx, _ = tree.query(polys[left.index.values], predicate='intersects')
+    flag = np.zeros(len(left))
+    flag[left_idx] = 1
+    return pd.Series(flag, index=left.index)
+
+
+def join_binary(left, hits):
+    _, pixel_idx = hits
+    return pd.Series(np.isin(left.index.values, pixel_idx).astype(float), index=left.index)
+
+
+def join_numeric(left, right, hits, column):
+    right_idx, pixel_idx = hits
+    values = pd.Series(right[column].to_numpy()[right_idx], index=pixel_idx)
+    values = values[np.isin(pixel_idx, left.index.values)]
+    return values.groupby(level=0, sort=False).max().reindex(left.index, fill_value=0)
+
+
+def join_nearest(left, right, column):
+    joined = gpd.sjoin_nearest(left[[left.geometry.name]], right, how="left")
+    return joined[column].groupby(level=0, sort=False).max().reindex(left.index)
+
+
+def join_popmul(left, right, column, pop_col):
+    joined = gpd.sjoin_nearest(left[[left.geometry.name]], right, how="left")
+    return left[pop_col]*joined[column].groupby(level=0, sort=False).max().reindex(left.index)
+
+
+def join_max(left, right, polys, column):
+    left_polys = gpd.GeoDataFrame(geometry=polys[left.index.values], index=left.index)
+    joined = gpd.sjoin(left_polys, right, how='left')
+    return joined[column].groupby(level=0, sort=False).max().reindex(left.index).fillna(0)
 
 
 if __name__=="__main__":
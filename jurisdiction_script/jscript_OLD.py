@@ -1,18 +1,22 @@
 import warnings
 warnings.filterwarnings('ignore')
 
-import glob
-import tqdm
 import yaml
-import fiona
-import pickle
 import shapely
 import argparse
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from scipy import signal
-import matplotlib.pyplot as plt
+import pyogrio
+from joblib import Parallel, delayed
+
+
+# Output drivers by the config's optional output_format (GeoJSON by default)
+OUTPUT_DRIVERS = {
+    'json': 'GeoJSON',
+    'gpkg': 'GPKG',
+    'fgb': 'FlatGeobuf',
+}
 
 
 def run(config):
@@ -20,111 +24,137 @@ def run(config):
     OUTPUT_PATH = r'.\out'
     county = config['county']
     city = config['city']
-    jbounds = gpd.read_file('{}\\{}'.format(DATA_PATH, config['boundary']))
-    
+    output_format = config.get('output_format', 'json')
+    assert output_format in OUTPUT_DRIVERS, f'Unsupported output format {output_format}, exiting'
+
     for pixel_type in ['priority', 'feasibility']:
         assert pixel_type in config, f'{pixel_type} not found in config file, exiting'
+    unknown = [column['join'] for pixel_type in ['priority', 'feasibility'] for att_file in config[pixel_type]['attributes'] or []
+               for column in att_file['columns'] if column['join'] not in JOINS]
+    assert not unknown, f'Inappropriate join type specified: {unknown}'
+
+    jbounds = pyogrio.read_dataframe('{}\\{}'.format(DATA_PATH, config['boundary']))
 
+    # (reprojected layer, STRtree) by (file, CRS), shared by both pixel types
+    att_datas = {}
+    
+    for pixel_type in ['priority', 'feasibility']:
         pixels_fname = config[pixel_type]['pixels']
         print('Reading in {} pixels...'.format(pixel_type), end=' ', flush=True)
-        pixels = gpd.read_file('{}\\{}'.format(DATA_PATH, pixels_fname))
+        pixels = pyogrio.read_dataframe('{}\\{}'.format(DATA_PATH, pixels_fname))
         print('done')
 
-        pixels['centroid'] = pixels.geometry.centroid
-        pixels.set_geometry('centroid', inplace=True)
-        pixels = gpd.clip(pixels, jbounds.to_crs(pixels.crs))
+        # Tree positions are pixel labels (pixels are read with a default RangeIndex)
+        polys = pixels.geometry.values
+        pixels['geometry'] = pixels.geometry.centroid
+
+        jgeom = shapely.union_all(jbounds.to_crs(pixels.crs).geometry.values)
+        shapely.prepare(jgeom)
+        pixel_x, pixel_y = shapely.get_coordinates(pixels.geometry.values).T
+        xmin, ymin, xmax, ymax = jgeom.bounds
+        idx = np.nonzero((pixel_x>=xmin) & (pixel_x<=xmax) & (pixel_y>=ymin) & (pixel_y<=ymax))[0]
+        idx = idx[shapely.intersects_xy(jgeom, pixel_x[idx], pixel_y[idx])]
+        pixels = pixels.iloc[idx]
+        pixel_x, pixel_y = pixel_x[idx], pixel_y[idx]
+
+        pixel_tree = shapely.STRtree(pixels.geometry.values)
 
         attributes = config[pixel_type]['attributes']
-        print('Joining in attributes:')
+        columns = []
         if attributes:
             for att_file in attributes:
-                print('\tFrom file {}...'.format(att_file['file']))
-                att_data = gpd.read_file('{}\\{}'.format(DATA_PATH, att_file['file']))
+                print('Reading in attributes from {}...'.format(att_file['file']), end=' ', flush=True)
+                att_key = (att_file['file'], pixels.crs)
+                if att_key not in att_datas:
+                    att_data = pyogrio.read_dataframe('{}\\{}'.format(DATA_PATH, att_file['file'])).to_crs(pixels.crs)
+                    att_datas[att_key] = att_data, shapely.STRtree(att_data.geometry.values)
+                att_data, att_tree = att_datas[att_key]
+
+                hits = None
+                if any(column['join'] in ['binary', 'numeric'] for column in att_file['columns']):
+                    att_geoms = att_data.geometry.values
+                    shapely.prepare(att_geoms)
+                    right_idx, pixel_idx = pixel_tree.query(att_geoms)
+                    hit = shapely.intersects_xy(att_geoms[right_idx], pixel_x[pixel_idx], pixel_y[pixel_idx])
+                    hits = right_idx[hit], pixel_idx[hit]
 
                 for column in att_file['columns']:
-                    col = column['column']
-                    name = column['name']
-                    join = column['join']
-                    assert join in ['binary', 'numeric', 'nearest', 'popmul', 'max'], "Inappropriate join type specified"
-                    
-                    print('\t\t{}...'.format(name), end=' ', flush=True)
-                    if join=='binary':
-                        pixels = join_binary(pixels, att_data, name)
-                    elif join=='numeric':
-                        pixels = join_numeric(pixels, att_data, col, name)
-                    elif join=='nearest':
-                        pixels = join_nearest(pixels, att_data, col, name)
-                    elif join=='popmul':
-                        pixels = join_popmul(pixels, att_data, col, 'pop', name)
-                    elif join=='max':
-                        pixels = join_max(pixels, att_data, col, name)
-                    print('done')
-
-        pixels.set_geometry('geometry', inplace=True)
-        to_drop = ['centroid']
-        pixels.drop(columns=to_drop, inplace=True, errors='ignore')
-
-        outfile = "{}\\{}_{}_{}.json".format(OUTPUT_PATH, county, city, pixel_type)
+                    columns.append((column, att_data, att_tree, hits))
+                print('done')
+
+        print('Joining in attributes:')
+        results = Parallel(n_jobs=-1, prefer='threads')(
+            delayed(join_column)(pixels, att_data, att_tree, hits, polys, column) for column, att_data, att_tree, hits in columns)
+        pixels = pixels.assign(**{column['name']: values for (column, _, _, _), values in zip(columns, results)})
+
+        pixels['geometry'] = polys[pixels.index.values]
+
+        outfile = "{}\\{}_{}_{}.{}".format(OUTPUT_PATH, county, city, pixel_type, output_format)
         print('Saving to {}...'.format(outfile), end=' ', flush=True)
-        pixels.to_file(outfile, driver='GeoJSON')
+        pyogrio.write_dataframe(pixels, outfile, driver=OUTPUT_DRIVERS[output_format])
         print('done')
 
     return
 
 
-def join_binary(left, right, name):
-    right = gpd.GeoDataFrame(right)
-    left = gpd.sjoin(left, right.to_crs(left.crs), how="left")
-    left.loc[~left.index_right.isnull(), 'index_right'] = 1
-    left['index_right'].fillna(0, inplace=True)
-    left.rename(columns={"index_right": name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_numeric(left, right, column, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin(left, right2.to_crs(left.crs), how="left")
-    left.loc[left['index_right'].isna(), column] = 0
-    left.rename(columns={column: name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_nearest(left, right, column, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin_nearest(left, right2.to_crs(left.crs), how="left")
-    left.rename(columns={column: name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
-
-
-def join_popmul(left, right, column, pop_col, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left = gpd.sjoin_nearest(left, right2.to_crs(left.crs), how="left")
-    left[name] = left[pop_col]*left[column]
-    left.drop(columns=['index_left', 'index_right', column], inplace=True, errors='ignore')
-    return left
-
-
-def join_max(left, right, column, name):
-    right = gpd.GeoDataFrame(right)
-    to_drop = [c for c in right.columns if c!=column and c!='geometry']
-    right2 = right.drop(columns=to_drop, errors='ignore')
-    left.set_geometry('geometry', inplace=True)
-    left = left.sjoin(right2.to_crs(left.crs), how='left')
-    left.set_geometry('centroid', inplace=True)
-    left = left.sort_values(column, ascending=False).drop_duplicates('geometry').sort_index()
-    left[column].fillna(0, inplace=True)
-    left.rename(columns={column: name}, inplace=True)
-    left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
-    return left
+def join_column(left, right, tree, hits, polys, column):
+    values = JOINS[column['join']](left, right, tree, hits, polys, column['column'])
+    print('\t{}... done'.format(column['name']), flush=True)
+    return values
+
+
+def attribute_values(right, column):
+    values = right[column]
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float32)
+    return values.to_numpy()
+
+
+def join_binary(left, hits):
+    _, pixel_idx = hits
+    flag = np.zeros(len(left), dtype=np.uint8)
+    flag[pixel_idx] = 1
+    return flag
+
+
+def join_numeric(left, right, hits, column):
+    right_idx, pixel_idx = hits
+    values = pd.Series(attribute_values(right, column)[right_idx], index=pixel_idx)
+    return values.groupby(level=0, sort=False).max().reindex(np.arange(len(left)), fill_value=0).to_numpy()
+
+
+def join_nearest(left, right, tree, column):
+    left_idx, right_idx = tree.query_nearest(left.geometry.values, all_matches=True)
+    values = pd.Series(right[column].to_numpy()[right_idx], index=left_idx)
+    return values.groupby(level=0, sort=False).max().reindex(np.arange(len(left))).to_numpy()
+
+
+def join_popmul(left, right, tree, column, pop_col):
+    left_idx, right_idx = tree.query_nearest(left.geometry.values, all_matches=True)
+    values = pd.Series(attribute_values(right, column)[right_idx], index=left_idx)
+    return left[pop_col].to_numpy(dtype=np.float32)*values.groupby(level=0, sort=False).max().reindex(np.arange(len(left))).to_numpy()
+
+
+def join_max(left, right, tree, polys, column):
+    left_idx, right_idx = tree.query(polys[left.index.values], predicate='intersects')
+    right_values = attribute_values(right, column)[right_idx]
+    if right_values.dtype != np.float32:
+        values = pd.Series(right_values, index=left_idx)
+        return values.groupby(level=0, sort=False).max().reindex(np.arange(len(left)), fill_value=0).to_numpy()
+    values = np.full(len(left), np.nan, dtype=np.float32)
+    np.fmax.at(values, left_idx, right_values)
+    return np.where(np.isnan(values), 0, values)
+
+
+# Join functions by config join type; numeric attributes are joined as float32
+# (nearest joins keep the attribute dtype) and binary flags as uint8
+JOINS = {
+    'binary': lambda left, right, tree, hits, polys, column: join_binary(left, hits),
+    'numeric': lambda left, right, tree, hits, polys, column: join_numeric(left, right, hits, column),
+    'nearest': lambda left, right, tree, hits, polys, column: join_nearest(left, right, tree, column),
+    'popmul': lambda left, right, tree, hits, polys, column: join_popmul(left, right, tree, column, 'pop'),
+    'max': lambda left, right, tree, hits, polys, column: join_max(left, right, tree, polys, column),
+}
 
 
 if __name__=="__main__":
@@ -140,9 +170,9 @@ if __name__=="__main__":
 
 
 def old():
-    pop_mfre = gpd.read_file(r"C:\Users\ariba\Documents\GSR\EV Equity\savio\data\pop_data\pop_mfre_total_6.json")
-    ces4 = gpd.read_file('C:\\Users\\ariba\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\CES4 Final Shapefile.shp')
-    city_lims = gpd.read_file('C:\\Users\\ariba\\Downloads\\GIS Data\\City_Boundaries.shp')
+    pop_mfre = pyogrio.read_dataframe(r"C:\Users\ariba\Documents\GSR\EV Equity\savio\data\pop_data\pop_mfre_total_6.json")
+    ces4 = pyogrio.read_dataframe('C:\\Users\\ariba\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\CES4 Final Shapefile.shp')
+    city_lims = pyogrio.read_dataframe('C:\\Users\\ariba\\Downloads\\GIS Data\\City_Boundaries.shp')
     sf_lim = city_lims.loc[city_lims.CITY=='San Francisco']
     oak_lim = city_lims.loc[city_lims.CITY=='Oakland']
 
@@ -152,7 +182,7 @@ def old():
     df_sf = gpd.clip(pop_mfre, sf_lim.to_crs(pop_mfre.crs))
     df_oak = gpd.clip(pop_mfre, oak_lim.to_crs(pop_mfre.crs))
     # NEVI
-    nevi = gpd.read_file("C:\\Users\\ariba\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\Electric_Fuel_Corridor_Groups_(Updated_December_2023).shp")
+    nevi = pyogrio.read_dataframe("C:\\Users\\ariba\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\Electric_Fuel_Corridor_Groups_(Updated_December_2023).shp")
     nevi = nevi.loc[nevi.Corridor_G!='Ineligible for Funding']
     nevi = nevi.buffer(1609)
     nevi_sf = gpd.clip(nevi, sf_lim.to_crs(nevi.crs))
@@ -163,7 +193,7 @@ def old():
     # PGE
     pge_path = "{}\\ICADisplay.gdb\\ICADisplay.gdb".format(DATA_PATH)
     layername = 'LineDetail'
-    pge = gpd.read_file(pge_path, driver='fileGDB', layer=layername)
+    pge = pyogrio.read_dataframe(pge_path, layer=layername)
 
     pge_sf = gpd.clip(pge, sf_lim.to_crs(pge.crs))
     pge_oak = gpd.clip(pge, oak_lim.to_crs(pge.crs))
@@ -172,7 +202,7 @@ def old():
     #pgebuf = gpd.GeoDataFrame(geometry=[pgeu], crs=pge.crs)
     
     # IRS 30C
-    irs30c = gpd.read_file("C:\\Users\\ariba\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\30c-all-tracts.shp")
+    irs30c = pyogrio.read_dataframe("C:\\Users\\ariba\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\30c-all-tracts.shp")
     irs30c_sf = gpd.clip(irs30c, sf_lim.to_crs(irs30c.crs))
     irs30c_oak = gpd.clip(irs30c, oak_lim.to_crs(irs30c.crs))
 
@@ -189,58 +219,37 @@ def old():
     #lev = gpd.read_file("C:\\Users\\ariba\\OneDrive\\Documents\\ArcGIS\\Projects\\Oakland EV Mapping ABB\\Test Data\\LEV Vehicle per capita.shp")
     #lev['lev_pc'] = lev['sum_Number']/lev['population']
 
-    lev_count = vehicle_count.loc[(vehicle_count['Fuel']=='Battery Electric') & (vehicle_count['Duty']=='Light')].groupby(['Zip Code']).sum()
-    lev_count.drop(columns=['Fuel', 'Duty'], inplace=True, errors='ignore')
-    lev_count = lev_count.reset_index()
-    lev_count['Zip Code'] = [str(e) for e in lev_count['Zip Code']]
+    lev_count = (vehicle_count.loc[(vehicle_count['Fuel']=='Battery Electric') & (vehicle_count['Duty']=='Light'), ['Zip Code', 'Vehicles']]
+                 .groupby('Zip Code', sort=False)['Vehicles'].sum()
+                 .reset_index())
+    lev_count['Zip Code'] = lev_count['Zip Code'].astype(str)
 
-    zipcodes_sf = gpd.read_file('{}\\California_Zip_Codes.geojson'.format(DATA_PATH))
-    zipcodes_sf.rename(columns={'ZIP_CODE': 'Zip Code'}, inplace=True)
-    lev_sf = zipcodes_sf.merge(lev_count, how='left', on='Zip Code')
+    zipcodes = pyogrio.read_dataframe('{}\\California_Zip_Codes.geojson'.format(DATA_PATH))
+    zipcodes.rename(columns={'ZIP_CODE': 'Zip Code'}, inplace=True)
+    zipcodes['Zip Code'] = zipcodes['Zip Code'].astype(str)
+    lev_sf = zipcodes.merge(lev_count, how='left', on='Zip Code')
     lev_sf['lev_pc'] = lev_sf['Vehicles']/lev_sf['POPULATION']
     lev_sf['lev_10000'] = lev_sf.lev_pc*10000
-
-    zipcodes_oak = gpd.read_file('{}\\California_Zip_Codes.shp'.format(DATA_PATH))
-    zipcodes_oak.rename(columns={'ZIP_CODE': 'Zip Code'}, inplace=True)
-    lev_oak = zipcodes_oak.merge(lev_count, how='left', on='Zip Code')
-    lev_oak['lev_pc'] = lev_oak['Vehicles']/lev_oak['POPULATION']
-    lev_oak['lev_10000'] = lev_oak.lev_pc*10000
-    sf_ej = gpd.read_file('{}\\San Francisco Environmental Justice Communities Map_20240307.geojson'.format(DATA_PATH))
-    sf_ej.score = sf_ej.score.astype(int)
-    sf_ej.loc[sf_ej.score==999, 'score'] = 0
+    lev_oak = lev_sf
+    sf_ej = pyogrio.read_dataframe('{}\\San Francisco Environmental Justice Communities Map_20240307.geojson'.format(DATA_PATH))
+    score = sf_ej.score.to_numpy(dtype=np.int16)
+    sf_ej['score'] = np.where(score==999, 0, score)
     def join_binary(left, right, name):
-        right = gpd.GeoDataFrame(right)
-        left = gpd.sjoin(left, right.to_crs(left.crs), how="left")
-        left.loc[~left.index_right.isnull(), 'index_right'] = 1
-        left['index_right'].fillna(0, inplace=True)
-        left.rename(columns={"index_right": name}, inplace=True)
-        left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
+        pairs = gpd.sjoin(left[[left.geometry.name]], right[[right.geometry.name]].to_crs(left.crs))
+        left[name] = left.index.isin(pairs.index).astype(np.uint8)
         return left
     def join_numeric(left, right, column, name):
-        right = gpd.GeoDataFrame(right)
-        to_drop = [c for c in right.columns if c!=column and c!='geometry']
-        right2 = right.drop(columns=to_drop, errors='ignore')
-        left = gpd.sjoin(left, right2.to_crs(left.crs), how="left")
-        left.loc[left['index_right'].isna(), column] = 0
-        left.rename(columns={column: name}, inplace=True)
-        left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
+        pairs = gpd.sjoin(left[[left.geometry.name]], right[[column, right.geometry.name]].to_crs(left.crs))
+        left[name] = pairs.groupby(level=0)[column].max().reindex(left.index, fill_value=0).to_numpy()
         return left
     def join_nearest(left, right, columns):
-        to_drop = [c for c in right.columns if c not in columns and c!='geometry']
-        right2 = right.drop(columns=to_drop, errors='ignore')
-        left = gpd.sjoin_nearest(left, right2.to_crs(left.crs), how="left")
-        left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
+        pairs = gpd.sjoin_nearest(left[[left.geometry.name]], right[columns + [right.geometry.name]].to_crs(left.crs))
+        left[columns] = pairs.groupby(level=0)[columns].max().reindex(left.index).to_numpy()
         return left
     def join_pge(left, pge):
-        to_drop = [c for c in pge.columns if c!='LoadCapacity_kW' and c!='geometry']
-        right2 = pge.drop(columns=to_drop, errors='ignore')
-        left.set_geometry('geometry', inplace=True)
-        left = left.sjoin(right2.to_crs(left.crs), how='left')
-        left.set_geometry('centroid', inplace=True)
-        left = left.sort_values('LoadCapacity_kW', ascending=False).drop_duplicates('geometry').sort_index()
-        left['LoadCapacity_kW'].fillna(0, inplace=True)
-        left.rename(columns={"LoadCapacity_kW": 'pge'}, inplace=True)
-        left.drop(columns=['index_left', 'index_right'], inplace=True, errors='ignore')
+        pairs = gpd.sjoin(left.set_geometry('geometry')[['geometry']], pge[['LoadCapacity_kW', pge.geometry.name]].to_crs(left.crs))
+        values = pairs.groupby(level=0)['LoadCapacity_kW'].max().reindex(left.index).to_numpy()
+        left['pge'] = np.where(np.isnan(values), 0, values)
         return left
     df_sf_r['centroid'] = df_sf_r.geometry.centroid #Create a centroid point column
     df_sf_r.set_geometry('centroid', inplace=True)
@@ -267,32 +276,23 @@ def old():
     to_drop = ['centroid']
     oak_pop.drop(columns=to_drop, inplace=True, errors='ignore')
     #sf_pop.to_file("{}\\sf_pop_pixels4.shp".format(DATA_PATH), driver='ESRI Shapefile')
-    sf_pop['Renters'] = sf_pop['pop']*sf_pop['% R']/100
-    sf_pop['Multi-Family Housing Residents'] = sf_pop['pop']*sf_pop['% MF']/100
+    sf_pop['Renters'] = sf_pop['pop']*sf_pop['% R']
+    sf_pop['Multi-Family Housing Residents'] = sf_pop['pop']*sf_pop['% MF']
 
-    oak_pop['Renters'] = oak_pop['pop']*oak_pop['% R']/100
-    oak_pop['Multi-Family Housing Residents'] = oak_pop['pop']*oak_pop['% MF']/100
+    oak_pop['Renters'] = oak_pop['pop']*oak_pop['% R']
+    oak_pop['Multi-Family Housing Residents'] = oak_pop['pop']*oak_pop['% MF']
     to_drop = ['% SF_OO', '% R', '% MF', 'sfoo']
     sf_pop.drop(columns=to_drop, inplace=True, errors='ignore')
     oak_pop.drop(columns=to_drop, inplace=True, errors='ignore')
-    sf_pop.to_file("{}\\sf_pop_pixels_4_4.json".format(DATA_PATH), driver='GeoJSON')
-    oak_pop.to_file("{}\\oak_pop_pixels_4_4.json".format(DATA_PATH), driver='GeoJSON')
-    sf_pop.columns
-
-
-    sf_pop = gpd.read_file("{}\\sf_pop_pixels_4_4.json".format(DATA_PATH))
-    oak_pop = gpd.read_file("{}\\oak_pop_pixels_4_4.json".format(DATA_PATH))
-
-    sf_pop['Renters'] = sf_pop['Renters']*100
-    sf_pop['Multi-Family Housing Residents'] = sf_pop['Multi-Family Housing Residents']*100
+    # Intermediate checkpoint; FlatGeobuf reads back far faster than GeoJSON
+    pyogrio.write_dataframe(sf_pop, "{}\\sf_pop_pixels_4_4.fgb".format(DATA_PATH), driver='FlatGeobuf')
+    pyogrio.write_dataframe(oak_pop, "{}\\oak_pop_pixels_4_4.fgb".format(DATA_PATH), driver='FlatGeobuf')
 
-    oak_pop['Renters'] = oak_pop['Renters']*100
-    oak_pop['Multi-Family Housing Residents'] = oak_pop['Multi-Family Housing Residents']*100
-    sf_pop.to_file("{}\\sf_priority.json".format(DATA_PATH), driver='GeoJSON')
-    oak_pop.to_file("{}\\oak_priority.json".format(DATA_PATH), driver='GeoJSON')
+    pyogrio.write_dataframe(sf_pop, "{}\\sf_priority.json".format(DATA_PATH), driver='GeoJSON')
+    pyogrio.write_dataframe(oak_pop, "{}\\oak_priority.json".format(DATA_PATH), driver='GeoJSON')
 
-    sf_pop.to_file("{}\\sf_feasibility.json".format(DATA_PATH), driver='GeoJSON')
-    oak_pop.to_file("{}\\oak_feasibility.json".format(DATA_PATH), driver='GeoJSON')
+    pyogrio.write_dataframe(sf_pop, "{}\\sf_feasibility.json".format(DATA_PATH), driver='GeoJSON')
+    pyogrio.write_dataframe(oak_pop, "{}\\oak_feasibility.json".format(DATA_PATH), driver='GeoJSON')
 
 
 
@@ -327,36 +327,31 @@ def old():
         iso['num_chg_pop1000'] = np.divide(iso['num_chg'], pop_by_iso/1000, where=pop_by_iso>=1)
         iso['num_chg_sfoo1000'] = np.divide(iso['num_chg'], (pop_by_iso-sfoo_by_iso)/1000, where=sfoo_by_iso>=1)
 
-        iso.loc[~iso.index.isin(idx_orig_pop), 'num_chg_pop1000'] = np.nan
-        iso.loc[~iso.index.isin(idx_orig_sfoo), 'num_chg_sfoo1000'] = np.nan
+        iso['num_chg_pop1000'] = np.where(iso.index.isin(idx_orig_pop), iso['num_chg_pop1000'], np.nan)
+        iso['num_chg_sfoo1000'] = np.where(iso.index.isin(idx_orig_sfoo), iso['num_chg_sfoo1000'], np.nan)
 
         # fr2 = fr.copy()
         # fr2['centroid'] = fr2.geometry.centroid
         # fr2 = fr2.set_geometry('centroid')
         # iso['geometry'] = iso.buffer(1e-14)
-        pop2['chg'] = (pop2
+        by_pixel = (pop2
                     .sjoin(iso, predicate='within', how='left')
                     .reset_index()
-                    .groupby('index')['num_chg'].sum())
-        pop2['chg_pop1000'] = (pop2
-                            .sjoin(iso, predicate='within', how='left')
-                            .reset_index()
-                            .groupby('index')['num_chg_pop1000'].sum())
-        pop2['chg_sfoo1000'] = (pop2
-                            .sjoin(iso, predicate='within', how='left')
-                            .reset_index()
-                            .groupby('index')['num_chg_sfoo1000'].sum())
+                    .groupby('index'))
+        pop2['chg'] = by_pixel['num_chg'].sum()
+        pop2['chg_pop1000'] = by_pixel['num_chg_pop1000'].sum()
+        pop2['chg_sfoo1000'] = by_pixel['num_chg_sfoo1000'].sum()
         # fr2 = fr2.loc[~fr2.geometry.is_empty]
         pop2.drop(columns=['centroid'], inplace=True)
         pop2.set_geometry('geometry', inplace=True)
 
-        pop2.chg.fillna(0, inplace=True)
-        pop2.chg_pop1000.fillna(0, inplace=True)
-        pop2.chg_sfoo1000.fillna(0, inplace=True)
+        for col in ['chg', 'chg_pop1000', 'chg_sfoo1000']:
+            values = pop2[col].to_numpy()
+            pop2[col] = np.where(np.isnan(values), 0, values)
 
         return pop2
-    iso_l2 = gpd.read_file(r"C:\Users\ariba\Documents\GSR\EV Equity\savio\data\isochrones\isochrones_walk_L2_10.0.json")
-    iso_dcf = gpd.read_file(r"C:\Users\ariba\Documents\GSR\EV Equity\savio\data\isochrones\isochrones_drive_DCF_10.0.json")
+    iso_l2 = pyogrio.read_dataframe(r"C:\Users\ariba\Documents\GSR\EV Equity\savio\data\isochrones\isochrones_walk_L2_10.0.json")
+    iso_dcf = pyogrio.read_dataframe(r"C:\Users\ariba\Documents\GSR\EV Equity\savio\data\isochrones\isochrones_drive_DCF_10.0.json")
     old_sums = ['sum_overlaps_walk_L2_5',
         'sum_overlaps_pop1000_walk_L2_5', 'sum_overlaps_sfoo1000_walk_L2_5',
         'sum_overlaps_walk_L2_10', 'sum_overlaps_pop1000_walk_L2_10',